@@ -9,12 +9,13 @@ from datetime import datetime, timedelta
 import pytz
 
 from models import User, TokenData
-from settings import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
-from settings import engine
+from settings import ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from settings import settings, get_engine
+from timetable import current_snapshot
 
 
 def get_session():
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         yield session
 
 SessionDep = Annotated[Session, Depends(get_session)]
@@ -23,6 +24,19 @@ pw_context = CryptContext(schemes=["django_pbkdf2_sha256"],deprecated="auto")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+def warm_up():
+    """
+    Prepare the worker before it starts accepting requests: read the settings, open the
+    connections of the pool and load the password hasher and the timetable snapshot.
+    """
+    settings.load()
+    engine = get_engine()
+    connections = [engine.connect() for _ in range(engine.pool.size())]
+    for connection in connections:
+        connection.close()
+    pw_context.handler()
+    current_snapshot()
+
 def authenticate_user(session, username, password):
     user = session.exec(select(User).where(User.username==username)).first()
     if not user:
@@ -38,7 +52,7 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     else:
         expire = datetime.now(pytz.timezone("Europe/Madrid")) + timedelta(minutes=15)
     to_encode.update({"exp":expire})
-    encoded_jwt = jwt.encode(to_encode,SECRET_KEY,algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode,settings.secret_key,algorithm=ALGORITHM)
     return encoded_jwt
 
 async def get_current_user(session: SessionDep, token: Annotated[str, Depends(oauth2_scheme)]):
@@ -48,7 +62,7 @@ async def get_current_user(session: SessionDep, token: Annotated[str, Depends(oa
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token,SECRET_KEY,algorithms=[ALGORITHM])
+        payload = jwt.decode(token,settings.secret_key,algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
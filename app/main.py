@@ -3,6 +3,7 @@ from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import Annotated
+from contextlib import asynccontextmanager
 from sqlmodel import SQLModel, Field, Session, select
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timedelta
@@ -14,9 +15,15 @@ from models import Bus, Travel, User, Customer, Ticket, TicketPublic, TicketBase
 from models import UserPublic, UserCreate, PasswordChange, UserUpdate
 from models import CITIES, EndpointTags, Message
 from dependencies import SessionDep, authenticate_user, create_access_token, get_current_user
-from dependencies import ACCESS_TOKEN_EXPIRE_MINUTES, pw_context
+from dependencies import ACCESS_TOKEN_EXPIRE_MINUTES, pw_context, warm_up
+from timetable import current_snapshot, is_fresh
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warm_up()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 @app.get("/buses", tags=[EndpointTags.system_information])
 def get_buses(session: SessionDep, limit: int | None = None) -> list[Bus]:
@@ -108,7 +115,10 @@ def get_travels(
         tzinfo = pytz.timezone('Europe/Madrid'),
     )
 
-    if query.origin and query.destination:
+    snapshot = current_snapshot()
+    if snapshot is not None and is_fresh(snapshot):
+        travels = snapshot.search(first_hour, next_day, query.origin, query.destination)
+    elif query.origin and query.destination:
         travels = session.exec(select(Travel)
             .where(Travel.schedule > first_hour, Travel.schedule < next_day)     
             .where(Travel.origin == query.origin)
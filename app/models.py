@@ -5,7 +5,7 @@ from sqlmodel import Column, DateTime, BigInteger, String, ForeignKey, SmallInte
 from typing_extensions import Self
 from enum import Enum
 from datetime import datetime, date
-from settings import engine
+from settings import get_engine
 import pytz
 
 
@@ -247,7 +247,7 @@ class TicketPublic(TicketBase):
 # Create the tables in the database running *python3 models.py*.
 
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+    SQLModel.metadata.create_all(get_engine())
 
 if __name__ == "__main__":
     create_db_and_tables()
@@ -0,0 +1,163 @@
+"""
+Round trip checks of the timetable snapshot: the searches answered from a compiled
+snapshot must return the same travels as the filters of get_travels in the database.
+"""
+import itertools
+from datetime import datetime, timedelta
+import pytest
+import pytz
+
+import timetable
+from models import Travel, CityChoices
+from timetable import TimetableSnapshot, compile_snapshot, snapshot_size
+
+
+MADRID = pytz.timezone("Europe/Madrid")
+BUS_IDS = ["AA00", "BB11", "CC22"]
+START = MADRID.localize(datetime(2025, 3, 29, 0, 0))
+
+
+def make_travels() -> list[Travel]:
+    # Every 3 hours over 4 days, crossing the change to summer time on 2025-03-30.
+    cities = [city.value for city in CityChoices]
+    travels = []
+    for i in range(32):
+        travels.append(Travel(
+            id = 100 + i,
+            schedule = (START + timedelta(hours=3*i)).astimezone(MADRID),
+            origin = cities[i % len(cities)],
+            destination = cities[(i + 3) % len(cities)],
+            bus_id = BUS_IDS[i % len(BUS_IDS)],
+        ))
+    return travels
+
+def write_snapshot(tmp_path, travels, bus_ids=BUS_IDS) -> TimetableSnapshot:
+    path = tmp_path / "timetable-1.bin"
+    path.write_bytes(compile_snapshot(1, travels, bus_ids, (len(travels), 0, 0)))
+    return TimetableSnapshot(str(path))
+
+def search_like_sql(travels, after, before, origin=None, destination=None):
+    return [
+        travel for travel in travels
+        if after < travel.schedule < before
+        and (not origin or travel.origin == origin)
+        and (not destination or travel.destination == destination)
+    ]
+
+def as_rows(travels):
+    return [(t.id, t.schedule, t.origin, t.destination, t.bus_id) for t in travels]
+
+
+# Ranges starting and ending exactly on a travel check the strict comparisons.
+RANGES = [
+    (START, START + timedelta(days=1)),
+    (START - timedelta(microseconds=1), START + timedelta(hours=3)),
+    (START + timedelta(hours=6), START + timedelta(hours=30)),
+    (START + timedelta(days=1), START + timedelta(days=2)),
+    (START - timedelta(days=2), START - timedelta(days=1)),
+    (START + timedelta(days=10), START + timedelta(days=11)),
+]
+
+@pytest.mark.parametrize("after, before", RANGES)
+@pytest.mark.parametrize("origin, destination", [
+    (None, None),
+    (CityChoices.madrid, None),
+    (None, CityChoices.burgos),
+    (CityChoices.madrid, CityChoices.burgos),
+    (CityChoices.toledo, CityChoices.madrid),
+])
+def test_search_matches_database_filters(tmp_path, after, before, origin, destination):
+    travels = make_travels()
+    snapshot = write_snapshot(tmp_path, travels)
+    expected = search_like_sql(travels, after, before, origin, destination)
+    assert as_rows(snapshot.search(after, before, origin, destination)) == as_rows(expected)
+
+def test_search_covers_every_travel(tmp_path):
+    travels = make_travels()
+    snapshot = write_snapshot(tmp_path, travels)
+    found = snapshot.search(START - timedelta(seconds=1), START + timedelta(days=5))
+    assert len(snapshot) == len(travels)
+    assert as_rows(found) == as_rows(travels)
+
+def test_empty_snapshot(tmp_path):
+    snapshot = write_snapshot(tmp_path, [], [])
+    assert len(snapshot) == 0
+    for (after, before), origin, destination in itertools.product(
+        RANGES, [None, CityChoices.madrid], [None, CityChoices.oviedo],
+    ):
+        assert snapshot.search(after, before, origin, destination) == []
+
+def test_snapshot_size(tmp_path):
+    data = compile_snapshot(1, make_travels(), BUS_IDS)
+    assert len(data) == snapshot_size(32, len(BUS_IDS))
+
+@pytest.mark.parametrize("content", [b"", b"BTTS" + b"\0"*6, "truncated", "extended"])
+def test_corrupted_snapshot_is_rejected(tmp_path, content):
+    data = compile_snapshot(1, make_travels(), BUS_IDS)
+    if content == "truncated":
+        content = data[:-1]
+    elif content == "extended":
+        content = data + b"\0"
+    path = tmp_path / "timetable-1.bin"
+    path.write_bytes(content)
+    with pytest.raises(ValueError):
+        TimetableSnapshot(str(path))
+
+def test_current_snapshot_keeps_previous_version_when_new_one_is_corrupted(tmp_path, monkeypatch):
+    monkeypatch.setattr(timetable, "_snapshot", None)
+    monkeypatch.setattr(timetable, "_current_stat", None)
+    (tmp_path / "timetable-1.bin").write_bytes(compile_snapshot(1, make_travels(), BUS_IDS))
+    (tmp_path / "CURRENT").write_text("1")
+    assert timetable.current_snapshot(str(tmp_path)).version == 1
+
+    (tmp_path / "timetable-2.bin").write_bytes(b"BTTS")
+    (tmp_path / "CURRENT.tmp").write_text("2")
+    (tmp_path / "CURRENT.tmp").replace(tmp_path / "CURRENT")
+    assert timetable.current_snapshot(str(tmp_path)).version == 1
+
+
+class FingerprintSession:
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+
+    def exec(self, statement):
+        return self
+
+    def one(self):
+        return self.fingerprint
+
+    def all(self):
+        return []
+
+def test_is_fresh_only_while_the_publisher_verifies_the_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(timetable, "_verified", None)
+    snapshot = write_snapshot(tmp_path, make_travels())
+    assert not timetable.is_fresh(snapshot, str(tmp_path))
+
+    (tmp_path / "VERIFIED").write_text("1")
+    assert timetable.is_fresh(snapshot, str(tmp_path))
+
+    (tmp_path / "VERIFIED.tmp").write_text("2")
+    (tmp_path / "VERIFIED.tmp").replace(tmp_path / "VERIFIED")
+    assert not timetable.is_fresh(snapshot, str(tmp_path))
+
+    monkeypatch.setattr(timetable, "STALE_AFTER", -1)
+    (tmp_path / "VERIFIED").write_text("1")
+    assert not timetable.is_fresh(snapshot, str(tmp_path))
+
+def test_verify_snapshot_publishes_when_fingerprint_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(timetable, "_snapshot", None)
+    monkeypatch.setattr(timetable, "_current_stat", None)
+    monkeypatch.setattr(timetable, "_verified", None)
+    directory = str(tmp_path)
+    session = FingerprintSession((0, 0, 0))
+
+    assert timetable.verify_snapshot(session, directory) == 1
+    assert timetable.verify_snapshot(session, directory) == 1
+    assert timetable.is_fresh(timetable.current_snapshot(directory), directory)
+
+    session.fingerprint = (1, 5, 42)
+    assert timetable.verify_snapshot(session, directory) == 2
+    snapshot = timetable.current_snapshot(directory)
+    assert snapshot.version == 2 and snapshot.fingerprint == (1, 5, 42)
+    assert timetable.is_fresh(snapshot, directory)
@@ -0,0 +1,318 @@
+"""
+Timetable snapshot shared by every worker of the API.
+
+The travel and bus tables are compiled into a binary file with one array per column,
+travels sorted by schedule. Workers map the file read-only, so the operating system keeps
+a single copy of it in memory no matter how many workers are running, and searches
+are answered with a binary search over the schedules without querying the database.
+
+Every snapshot has its own version number and file. The CURRENT file holds the version
+in use and it is replaced atomically once the new snapshot is written, so the workers
+never see a partial snapshot.
+
+The header stores a fingerprint of booking_travel taken when the snapshot was compiled.
+Only the publisher, *python3 timetable.py --watch*, reads the fingerprint of the table:
+every FRESHNESS_INTERVAL seconds it compares it with the snapshot, publishes a new one
+if they differ and writes the version it verified to the VERIFIED file. Workers never
+query the database to check the snapshot, they only use it while VERIFIED names its
+version and has been written in the last STALE_AFTER seconds, and answer from the
+database otherwise, for instance when the publisher is not running.
+
+The snapshot is not updated at the moment the schedule changes. After a travel is added,
+moved or deleted, searches keep returning the previous schedule until the publisher's
+next check, that is for up to FRESHNESS_INTERVAL seconds plus the time it takes to read
+the fingerprint, and for at most STALE_AFTER seconds if the publisher stops right after
+verifying a version.
+"""
+import os
+import sys
+import mmap
+import time
+import argparse
+import struct
+import bisect
+from array import array
+from datetime import datetime, timedelta, timezone
+import pytz
+from sqlmodel import Session, select, text
+
+from models import Bus, Travel
+from settings import settings
+
+
+MAGIC = b"BTTS"
+FORMAT_VERSION = 2
+CURRENT = "CURRENT"
+VERSIONS_KEPT = 2
+VERIFIED = "VERIFIED"
+FRESHNESS_INTERVAL = 30
+STALE_AFTER = 2*FRESHNESS_INTERVAL
+
+# magic, format version, padding, snapshot version, number of travels, number of buses,
+# and the fingerprint: number of travels, highest travel id and checksum of the rows
+HEADER = struct.Struct("<4sHHQIIqqq")
+
+# Computed by the database so it does not depend on how the rows are transferred. The
+# checksum changes when a travel is added, deleted or any of its columns is updated.
+FINGERPRINT_QUERY = text("""
+    SELECT count(*), coalesce(max(id), 0), coalesce(sum(hashtext(concat_ws('|',
+        id, extract(epoch FROM schedule), origin, destination, bus_id)))::bigint, 0)
+    FROM booking_travel
+""")
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def to_microseconds(moment: datetime) -> int:
+    return (moment - EPOCH) // MICROSECOND
+
+def from_microseconds(microseconds: int) -> datetime:
+    return (EPOCH + microseconds * MICROSECOND).astimezone(pytz.timezone("Europe/Madrid"))
+
+def read_fingerprint(session: Session) -> tuple[int, int, int]:
+    return tuple(session.exec(FINGERPRINT_QUERY).one())
+
+
+def snapshot_size(travels: int, buses: int) -> int:
+    """
+    Size in bytes of a snapshot: the header, id and schedule (8 bytes), bus index,
+    origin and destination (2 bytes) for every travel, and the id of every bus (4 bytes).
+    """
+    return HEADER.size + 22*travels + 4*buses
+
+
+class TimetableSnapshot:
+    """
+    Read-only view of a snapshot file. The columns are memoryviews over the mapped file,
+    nothing is copied into the worker memory until a search builds its results.
+    """
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < HEADER.size:
+            raise ValueError(f"{path} is not a timetable snapshot.")
+        magic, format_version, _, self.version, travels, buses, *fingerprint = (
+            HEADER.unpack_from(self._mmap)
+        )
+        self.fingerprint = tuple(fingerprint)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a timetable snapshot.")
+        if len(self._mmap) != snapshot_size(travels, buses):
+            raise ValueError(f"{path} is truncated or corrupted.")
+
+        view = memoryview(self._mmap)
+        offset = HEADER.size
+        self._ids = view[offset:offset + 8*travels].cast("q")
+        offset += 8*travels
+        self._schedules = view[offset:offset + 8*travels].cast("q")
+        offset += 8*travels
+        self._bus_indexes = view[offset:offset + 2*travels].cast("H")
+        offset += 2*travels
+        self._origins = view[offset:offset + 2*travels]
+        offset += 2*travels
+        self._destinations = view[offset:offset + 2*travels]
+        offset += 2*travels
+        self._bus_ids = view[offset:offset + 4*buses]
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _bus_id(self, index: int) -> str:
+        return bytes(self._bus_ids[4*index:4*index + 4]).rstrip(b"\0").decode()
+
+    def search(
+        self,
+        after: datetime,
+        before: datetime,
+        origin: str | None = None,
+        destination: str | None = None,
+    ) -> list[Travel]:
+        """
+        Travels scheduled strictly between after and before, optionally filtered by
+        origin and destination city codes.
+        """
+        first = bisect.bisect_right(self._schedules, to_microseconds(after))
+        last = bisect.bisect_left(self._schedules, to_microseconds(before))
+        origin_code = _city_code(origin) if origin else None
+        destination_code = _city_code(destination) if destination else None
+
+        travels = []
+        for i in range(first, last):
+            if origin_code and self._origins[2*i:2*i + 2] != origin_code:
+                continue
+            if destination_code and self._destinations[2*i:2*i + 2] != destination_code:
+                continue
+            travels.append(Travel(
+                id = self._ids[i],
+                schedule = from_microseconds(self._schedules[i]),
+                origin = bytes(self._origins[2*i:2*i + 2]).rstrip(b"\0").decode(),
+                destination = bytes(self._destinations[2*i:2*i + 2]).rstrip(b"\0").decode(),
+                bus_id = self._bus_id(self._bus_indexes[i]),
+            ))
+        return travels
+
+
+def _city_code(city: str) -> bytes:
+    return city.encode().ljust(2, b"\0")
+
+def _bus_code(bus_id: str) -> bytes:
+    return bus_id.encode().ljust(4, b"\0")
+
+def compile_snapshot(
+    version: int,
+    travels: list[Travel],
+    bus_ids: list[str],
+    fingerprint: tuple[int, int, int] = (0, 0, 0),
+) -> bytes:
+    """
+    Binary representation of the timetable. Travels must be sorted by schedule.
+    """
+    bus_indexes = {bus_id: index for index, bus_id in enumerate(bus_ids)}
+    return b"".join([
+        HEADER.pack(MAGIC, FORMAT_VERSION, 0, version, len(travels), len(bus_ids), *fingerprint),
+        array("q", [travel.id for travel in travels]).tobytes(),
+        array("q", [to_microseconds(travel.schedule) for travel in travels]).tobytes(),
+        array("H", [bus_indexes[travel.bus_id] for travel in travels]).tobytes(),
+        b"".join(_city_code(travel.origin) for travel in travels),
+        b"".join(_city_code(travel.destination) for travel in travels),
+        b"".join(_bus_code(bus_id) for bus_id in bus_ids),
+    ])
+
+
+def _snapshot_path(directory: str, version: int) -> str:
+    return os.path.join(directory, f"timetable-{version}.bin")
+
+def _write_atomically(path: str, data: bytes):
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+
+def read_current_version(directory: str | None = None) -> int:
+    directory = directory or settings.timetable_dir
+    try:
+        with open(os.path.join(directory, CURRENT)) as file:
+            return int(file.read().strip())
+    except FileNotFoundError:
+        return 0
+
+def publish_snapshot(session: Session, directory: str | None = None) -> int:
+    """
+    Compile the travel and bus tables into a new snapshot version and make it the current
+    one. Older versions are removed, the workers still using them keep their mapping
+    until they load the new version.
+    """
+    directory = directory or settings.timetable_dir
+    # The fingerprint is read first: if the schedule changes while the rows are read,
+    # the snapshot is seen as stale and published again instead of hiding the change.
+    fingerprint = read_fingerprint(session)
+    travels = session.exec(select(Travel).order_by(Travel.schedule, Travel.id)).all()
+    bus_ids = session.exec(select(Bus.bus_id).order_by(Bus.bus_id)).all()
+
+    os.makedirs(directory, exist_ok=True)
+    version = read_current_version(directory) + 1
+    _write_atomically(_snapshot_path(directory, version), compile_snapshot(version, travels, bus_ids, fingerprint))
+    _write_atomically(os.path.join(directory, CURRENT), str(version).encode())
+
+    for name in os.listdir(directory):
+        if name.startswith("timetable-") and name.endswith(".bin"):
+            old_version = int(name[len("timetable-"):-len(".bin")])
+            if old_version <= version - VERSIONS_KEPT:
+                os.remove(os.path.join(directory, name))
+    return version
+
+
+_snapshot: TimetableSnapshot | None = None
+_current_stat: tuple[int, int] | None = None
+
+def current_snapshot(directory: str | None = None) -> TimetableSnapshot | None:
+    """
+    Snapshot in use by this worker. The CURRENT file is checked on every call and the
+    new version is mapped once it has been published. Returns None if no snapshot has
+    been published yet, so the caller can fall back to the database.
+    """
+    global _snapshot, _current_stat
+    directory = directory or settings.timetable_dir
+    try:
+        stat = os.stat(os.path.join(directory, CURRENT))
+    except FileNotFoundError:
+        return _snapshot
+    if (stat.st_ino, stat.st_mtime_ns) == _current_stat:
+        return _snapshot
+
+    version = read_current_version(directory)
+    if _snapshot is None or _snapshot.version != version:
+        try:
+            _snapshot = TimetableSnapshot(_snapshot_path(directory, version))
+        except (FileNotFoundError, ValueError):
+            return _snapshot
+    _current_stat = (stat.st_ino, stat.st_mtime_ns)
+    return _snapshot
+
+
+def verify_snapshot(session: Session, directory: str | None = None) -> int:
+    """
+    Compare the current snapshot with booking_travel, publishing a new one if they differ,
+    and record the version verified in the VERIFIED file. Run by the publisher only.
+    """
+    directory = directory or settings.timetable_dir
+    snapshot = current_snapshot(directory)
+    if snapshot is None or read_fingerprint(session) != snapshot.fingerprint:
+        # Workers answer from the database until the new version is verified.
+        try:
+            os.remove(os.path.join(directory, VERIFIED))
+        except FileNotFoundError:
+            pass
+        version = publish_snapshot(session, directory)
+        print(f"Timetable snapshot version {version} published.")
+    else:
+        version = snapshot.version
+    _write_atomically(os.path.join(directory, VERIFIED), str(version).encode())
+    return version
+
+
+_verified: tuple[tuple[int, int], int] | None = None
+
+def is_fresh(snapshot: TimetableSnapshot, directory: str | None = None) -> bool:
+    """
+    Whether the publisher has verified the snapshot against booking_travel in the last
+    STALE_AFTER seconds. Only the VERIFIED file is read, never the database.
+    """
+    global _verified
+    directory = directory or settings.timetable_dir
+    path = os.path.join(directory, VERIFIED)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    if time.time() - stat.st_mtime > STALE_AFTER:
+        return False
+
+    if _verified is None or _verified[0] != (stat.st_ino, stat.st_mtime_ns):
+        try:
+            with open(path) as file:
+                _verified = ((stat.st_ino, stat.st_mtime_ns), int(file.read().strip()))
+        except (FileNotFoundError, ValueError):
+            return False
+    return _verified[1] == snapshot.version
+
+
+# Publish a new snapshot if the schedule changed running *python3 timetable.py*, or keep
+# it up to date with the schedule running *python3 timetable.py --watch*.
+
+if __name__ == "__main__":
+    from settings import get_engine
+
+    parser = argparse.ArgumentParser(description="Publish the timetable snapshot.")
+    parser.add_argument("--watch", action="store_true", help="publish every time the schedule changes")
+    args = parser.parse_args()
+
+    while True:
+        with Session(get_engine()) as session:
+            verify_snapshot(session)
+        if not args.watch:
+            sys.exit()
+        time.sleep(FRESHNESS_INTERVAL)